@@ -8,6 +8,8 @@ from urllib.parse import urljoin, urlparse
 import random
 from datetime import datetime
 import json
+import csv
+import hashlib
 from textblob import TextBlob
 import io
 
@@ -33,6 +35,22 @@ st.set_page_config(
     layout="wide"
 )
 
+# Motif combiné (domaine + ASIN): les marqueurs explicites (/dp/, /product/, asin=)
+# priment sur un segment de 10 caractères isolé dans le chemin
+AMAZON_URL_PATTERN = re.compile(
+    r'(?:(?=.*?amazon\.(co\.uk|fr|com|de)))?'
+    r'(?:(?=.*?(?:/dp/|/product/|asin=)([A-Z0-9]{10}))'
+    r'|(?=.*?/([A-Z0-9]{10})(?:/|$|[?&])))'
+)
+
+def parse_amazon_url(url):
+    """Extrait le couple (domaine, ASIN) d'une URL Amazon"""
+    match = AMAZON_URL_PATTERN.match(url)
+    if not match:
+        return None, None
+    domain, asin, fallback_asin = match.groups()
+    return f"amazon.{domain or 'fr'}", asin or fallback_asin
+
 class SentimentAnalyzer:
     """Analyseur de sentiment pour les commentaires"""
     
@@ -54,10 +72,46 @@ class SentimentAnalyzer:
         except:
             return "Neutre"
 
+class ReviewDeduplicator:
+    """Index de déduplication des avis partagés entre variantes d'un même produit"""
+    
+    def __init__(self):
+        self.seen = {}
+    
+    @staticmethod
+    def review_hash(review):
+        author = (review.get('author') or '').strip().lower()
+        date = (review.get('date') or '').strip().lower()
+        title = (review.get('title') or '').strip().lower()
+        rating = review.get('rating')
+        body = re.sub(r'\s+', ' ', review.get('content') or '').strip().lower()
+        key = f"{author}|{date}|{title}|{rating}|{body}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+    
+    def find_variant_group(self, reviews):
+        """Retourne l'URL du groupe déjà indexé si tous les avis sont déjà connus"""
+        owners = [self.seen.get(self.review_hash(r)) for r in reviews]
+        if not owners or not all(owners):
+            return None
+        return max(set(owners), key=owners.count)
+    
+    def register(self, reviews, url):
+        """Indexe les avis et ne retourne que ceux qui n'ont jamais été vus"""
+        new_reviews = []
+        for review in reviews:
+            review_hash = self.review_hash(review)
+            if review_hash in self.seen:
+                continue
+            self.seen[review_hash] = url
+            new_reviews.append(review)
+        return new_reviews
+
 class BasicAmazonScraper:
     """Scraper de base avec requests/BeautifulSoup amélioré"""
     
-    def __init__(self):
+    def __init__(self, deduplicator=None):
+        self.deduplicator = deduplicator
+        self.variant_of = None
         self.session = requests.Session()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -75,36 +129,16 @@ class BasicAmazonScraper:
         self.session.headers.update(self.headers)
     
     def clean_url(self, url):
-        patterns = [
-            r'/dp/([A-Z0-9]{10})',
-            r'/product/([A-Z0-9]{10})',
-            r'/gp/product/([A-Z0-9]{10})',
-            r'asin=([A-Z0-9]{10})',
-            r'/([A-Z0-9]{10})(?:/|$|[?&])'
-        ]
+        domain, asin = parse_amazon_url(url)
+        if not asin:
+            return None, None, None
         
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                asin = match.group(1)
-                if "amazon.fr" in url:
-                    domain = "amazon.fr"
-                elif "amazon.com" in url:
-                    domain = "amazon.com"
-                elif "amazon.de" in url:
-                    domain = "amazon.de"
-                elif "amazon.co.uk" in url:
-                    domain = "amazon.co.uk"
-                else:
-                    domain = "amazon.fr"
-                
-                clean_product_url = f"https://www.{domain}/dp/{asin}"
-                return clean_product_url, asin, domain
-        
-        return None, None, None
+        clean_product_url = f"https://www.{domain}/dp/{asin}"
+        return clean_product_url, asin, domain
     
     def extract_reviews_basic(self, product_url, max_pages=2):
         reviews = []
+        self.variant_of = None
         
         clean_url, asin, domain = self.clean_url(product_url)
         if not clean_url or not asin:
@@ -117,6 +151,7 @@ class BasicAmazonScraper:
         # Construire l'URL des avis
         reviews_base_url = f"https://www.{domain}/product-reviews/{asin}/ref=cm_cr_dp_d_show_all_btm?ie=UTF8&reviewerType=all_reviews&sortBy=recent&pageNumber=1"
         
+        checked_variant = False
         for page in range(1, max_pages + 1):
             try:
                 current_url = reviews_base_url.replace('pageNumber=1', f'pageNumber={page}')
@@ -137,18 +172,25 @@ class BasicAmazonScraper:
                     st.warning(f"Aucun avis trouvé sur la page {page}")
                     break
                 
-                page_reviews = 0
+                page_reviews = []
                 for review_element in review_elements:
                     review_data = self.extract_single_review(review_element)
                     if review_data and review_data.get('content'):
-                        reviews.append(review_data)
-                        page_reviews += 1
+                        page_reviews.append(review_data)
+                reviews.extend(page_reviews)
                 
-                st.success(f"Page {page}: {page_reviews} avis extraits")
+                st.success(f"Page {page}: {len(page_reviews)} avis extraits")
                 
-                if page_reviews == 0:
+                if not page_reviews:
                     break
                 
+                if not checked_variant and self.deduplicator:
+                    checked_variant = True
+                    self.variant_of = self.deduplicator.find_variant_group(page_reviews)
+                    if self.variant_of:
+                        st.info(f"Variante de {self.variant_of}: pagination ignorée")
+                        break
+                
                 next_disabled = soup.select_one('li.a-disabled.a-last')
                 if next_disabled:
                     st.info("Dernière page atteinte")
@@ -232,7 +274,9 @@ class BasicAmazonScraper:
 class AdvancedSeleniumScraper:
     """Scraper Selenium avec gestion automatique des drivers"""
     
-    def __init__(self):
+    def __init__(self, deduplicator=None):
+        self.deduplicator = deduplicator
+        self.variant_of = None
         self.driver = None
     
     def create_driver_auto(self):
@@ -277,6 +321,7 @@ class AdvancedSeleniumScraper:
     
     def extract_reviews_selenium(self, product_url, max_pages=2):
         reviews = []
+        self.variant_of = None
         
         if not self.create_driver_auto():
             st.error("Impossible de créer le driver Selenium")
@@ -311,6 +356,7 @@ class AdvancedSeleniumScraper:
                 time.sleep(random.uniform(3, 6))
             
             # Extraire les avis de chaque page
+            checked_variant = False
             for page in range(1, max_pages + 1):
                 st.write(f"Selenium - Page {page}...")
                 
@@ -331,6 +377,13 @@ class AdvancedSeleniumScraper:
                 
                 st.success(f"Page {page}: {len(page_reviews)} avis extraits")
                 
+                if not checked_variant and self.deduplicator and page_reviews:
+                    checked_variant = True
+                    self.variant_of = self.deduplicator.find_variant_group(page_reviews)
+                    if self.variant_of:
+                        st.info(f"Variante de {self.variant_of}: pagination ignorée")
+                        break
+                
                 # Page suivante
                 if page < max_pages:
                     try:
@@ -425,9 +478,78 @@ class AdvancedSeleniumScraper:
         
         return reviews
 
+def iter_table_cells(rows):
+    """Parcourt les cellules d'un tableau qui ressemblent à des URLs (en-têtes et libellés ignorés)"""
+    for row in rows:
+        for cell in row:
+            if isinstance(cell, str) and ('http' in cell.lower() or 'amazon.' in cell.lower()):
+                yield cell
+
+def iter_uploaded_urls(uploaded_file):
+    """Parcourt les valeurs d'un fichier .txt, .csv ou .xlsx ligne par ligne, sans tout charger en mémoire"""
+    name = uploaded_file.name.lower()
+    
+    if name.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(uploaded_file, read_only=True)
+        try:
+            for cell in iter_table_cells(workbook.active.iter_rows(values_only=True)):
+                yield cell
+        finally:
+            workbook.close()
+        return
+    
+    text_stream = io.TextIOWrapper(uploaded_file, encoding='utf-8', errors='ignore', newline='')
+    try:
+        if name.endswith('.csv'):
+            for cell in iter_table_cells(csv.reader(text_stream)):
+                yield cell
+        else:
+            for line in text_stream:
+                yield line
+    finally:
+        # Détacher pour ne pas fermer le fichier uploadé avec le wrapper
+        text_stream.detach()
+
+def prepare_batch(raw_urls):
+    """Normalise les URLs en couples (domaine, ASIN) et supprime les doublons, dans l'ordre de saisie"""
+    seen = set()
+    pairs = []
+    duplicates = 0
+    invalid = 0
+    
+    for raw_url in raw_urls:
+        if not isinstance(raw_url, str):
+            continue
+        raw_url = raw_url.strip()
+        if not raw_url:
+            continue
+        
+        domain, asin = parse_amazon_url(raw_url)
+        if not asin:
+            invalid += 1
+            continue
+        
+        if (domain, asin) in seen:
+            duplicates += 1
+            continue
+        
+        seen.add((domain, asin))
+        pairs.append((domain, asin))
+    
+    urls = [f"https://www.{domain}/dp/{asin}" for domain, asin in pairs]
+    return urls, duplicates, invalid
+
+def order_by_domain(urls):
+    """Regroupe les URLs par domaine pour réutiliser les connexions (tri stable)"""
+    return sorted(urls, key=lambda url: urlparse(url).netloc)
+
 def process_urls(urls, method, max_pages, progress_placeholder=None):
     """Traite une liste d'URLs avec la méthode choisie"""
     analyzer = SentimentAnalyzer()
+    deduplicator = ReviewDeduplicator()
+    # Une seule session HTTP pour tout le batch afin de réutiliser les connexions
+    basic_scraper = BasicAmazonScraper(deduplicator)
     results = []
     
     total_urls = len(urls)
@@ -442,25 +564,29 @@ def process_urls(urls, method, max_pages, progress_placeholder=None):
         # Choisir la méthode d'extraction
         reviews = []
         if method == "Requests + BeautifulSoup":
-            scraper = BasicAmazonScraper()
+            scraper = basic_scraper
             reviews = scraper.extract_reviews_basic(url.strip(), max_pages)
         elif method == "Selenium" and SELENIUM_AVAILABLE:
-            scraper = AdvancedSeleniumScraper()
+            scraper = AdvancedSeleniumScraper(deduplicator)
             reviews = scraper.extract_reviews_selenium(url.strip(), max_pages)
         else:
             st.error("Méthode non disponible ou bibliothèques manquantes")
             continue
         
-        if reviews:
-            # Calculer les statistiques
+        # Avis déjà vus pour une autre URL (variante): ni analyse ni export en double
+        variant_of = scraper.variant_of or deduplicator.find_variant_group(reviews)
+        new_reviews = deduplicator.register(reviews, url.strip())
+        
+        if new_reviews:
+            # Calculer les statistiques sur tous les avis du produit
             total_reviews = len(reviews)
             avg_rating = None
             ratings = [r['rating'] for r in reviews if r['rating'] is not None]
             if ratings:
                 avg_rating = sum(ratings) / len(ratings)
             
-            # Créer une ligne par avis avec analyse de sentiment
-            for review in reviews:
+            # Créer une ligne par avis non encore exporté avec analyse de sentiment
+            for review in new_reviews:
                 if review.get('content'):
                     sentiment = analyzer.analyze_sentiment(review['content'])
                     
@@ -479,16 +605,21 @@ def process_urls(urls, method, max_pages, progress_placeholder=None):
                         'votes_utiles': review.get('helpful_votes', 0)
                     })
             
-            st.success(f"Succès: {len(reviews)} avis extraits!")
+            st.success(f"Succès: {len(new_reviews)} avis extraits!")
         else:
-            st.error("Échec: Aucun avis extrait")
+            if variant_of:
+                st.info(f"Variante de {variant_of}: aucun nouvel avis")
+                message = f"Variante de {variant_of}"
+            else:
+                st.error("Échec: Aucun avis extrait")
+                message = "Aucun avis extrait"
             results.append({
                 'url': url.strip(),
                 'nombre_avis': 0,
                 'nombre_commentaires_client': 0,
                 'moyenne_avis': None,
                 'avis_notation': None,
-                'commentaire_associe': "Aucun avis extrait",
+                'commentaire_associe': message,
                 'sentiment': "N/A",
                 'auteur': '',
                 'date_avis': '',
@@ -558,9 +689,9 @@ pip install selenium webdriver-manager undetected-chromedriver
                 progress_bar = st.progress(0)
                 results = process_urls([product_url], method, max_pages, progress_bar)
                 
-                if results and any(r['commentaire_associe'] != "Aucun avis extrait" for r in results):
+                if results and any(r['sentiment'] != "N/A" for r in results):
                     df = pd.DataFrame(results)
-                    successful = df[df['commentaire_associe'] != "Aucun avis extrait"]
+                    successful = df[df['sentiment'] != "N/A"]
                     
                     st.success(f"Extraction réussie! {len(successful)} avis extraits")
                     
@@ -570,10 +701,10 @@ pip install selenium webdriver-manager undetected-chromedriver
                     st.dataframe(successful[display_cols].head(5), use_container_width=True)
                     
                     # Export
-                    csv = df.to_csv(index=False, encoding='utf-8-sig')
+                    csv_data = df.to_csv(index=False, encoding='utf-8-sig')
                     st.download_button(
                         label="Télécharger CSV",
-                        data=csv,
+                        data=csv_data,
                         file_name=f"avis_amazon_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                         mime="text/csv"
                     )
@@ -593,6 +724,8 @@ pip install selenium webdriver-manager undetected-chromedriver
         )
         
         urls = []
+        duplicates = 0
+        invalid = 0
         
         if input_method == "Saisie manuelle":
             urls_text = st.text_area(
@@ -601,13 +734,18 @@ pip install selenium webdriver-manager undetected-chromedriver
                 height=120
             )
             if urls_text:
-                urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
+                urls, duplicates, invalid = prepare_batch(urls_text.split('\n'))
         
         else:
-            uploaded_file = st.file_uploader("Fichier texte (.txt)", type=['txt'])
+            uploaded_file = st.file_uploader("Fichier d'URLs (.txt, .csv, .xlsx)", type=['txt', 'csv', 'xlsx'])
             if uploaded_file:
-                content = uploaded_file.read().decode('utf-8')
-                urls = [url.strip() for url in content.split('\n') if url.strip()]
+                try:
+                    urls, duplicates, invalid = prepare_batch(iter_uploaded_urls(uploaded_file))
+                except Exception as e:
+                    st.error(f"Fichier illisible: {str(e)}")
+        
+        if duplicates or invalid:
+            st.warning(f"{duplicates} doublons et {invalid} URLs invalides ignorés")
         
         if urls:
             st.info(f"{len(urls)} URLs détectées")
@@ -626,21 +764,20 @@ pip install selenium webdriver-manager undetected-chromedriver
                 estimated_time = (limit_urls if limit_urls > 0 else len(urls)) * max_pages * 30
                 st.info(f"Temps estimé: ~{estimated_time//60} minutes")
             
-            with st.expander("URLs à traiter"):
-                display_urls = urls[:limit_urls] if limit_urls > 0 else urls
-                for i, url in enumerate(display_urls, 1):
+            # Limite appliquée dans l'ordre de saisie, puis regroupement par domaine
+            urls = order_by_domain(urls[:limit_urls] if limit_urls > 0 else urls)
+            
+            with st.expander("URLs à traiter (groupées par domaine)"):
+                for i, url in enumerate(urls, 1):
                     st.write(f"{i}. {url}")
             
             if st.button("Lancer l'extraction batch", type="primary"):
-                if limit_urls > 0:
-                    urls = urls[:limit_urls]
-                
                 progress_bar = st.progress(0)
                 results = process_urls(urls, method, max_pages, progress_bar)
                 
                 if results:
                     df = pd.DataFrame(results)
-                    successful = df[df['commentaire_associe'] != "Aucun avis extrait"]
+                    successful = df[df['sentiment'] != "N/A"]
                     
                     st.subheader("Résultats batch")
                     
@@ -664,10 +801,10 @@ pip install selenium webdriver-manager undetected-chromedriver
                     st.subheader("Données complètes")
                     st.dataframe(df, use_container_width=True)
                     
-                    csv = df.to_csv(index=False, encoding='utf-8-sig')
+                    csv_data = df.to_csv(index=False, encoding='utf-8-sig')
                     st.download_button(
                         label="Télécharger CSV complet",
-                        data=csv,
+                        data=csv_data,
                         file_name=f"avis_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                         mime="text/csv"
                     )